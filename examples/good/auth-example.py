@@ -4,13 +4,24 @@
 このモジュールは、社内コーディング規約に準拠した
 認証機能の実装例を示しています。
 """
+import asyncio
+import base64
+import hashlib
+import hmac
+import itertools
+import json
 import logging
+import os
+import re
 import secrets
-from datetime import datetime, timedelta
-from typing import Optional
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Optional, Union
 
 import bcrypt
-import jwt
 from fastapi import HTTPException, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from tenacity import retry, stop_after_attempt, wait_exponential
@@ -30,6 +41,111 @@ logger = logging.getLogger(__name__)
 # セキュリティスキーム
 security = HTTPBearer()
 
+# bcryptのコスト（settings.BCRYPT_ROUNDS 未設定時の値）
+DEFAULT_BCRYPT_ROUNDS = 12
+
+# レート制限用Redisのタイムアウト（秒、settings.RATE_LIMIT_REDIS_TIMEOUT_SECONDS 未設定時の値）
+# 応答のないRedisでログイン全体が止まらないよう、短く設定してフォールバックさせる
+DEFAULT_RATE_LIMIT_REDIS_TIMEOUT_SECONDS = 0.2
+
+# パスワード検証結果キャッシュの設定
+VERIFY_CACHE_MAX_ENTRIES = 10_000
+VERIFY_CACHE_TTL_SECONDS = 60
+
+# DB問い合わせ前に弾く明らかに不正なメールアドレス形式（ローカル部64文字、ドメイン255文字まで）
+_EMAIL_PATTERN = re.compile(r"[^@\s]{1,64}@[^@\s]{1,255}")
+
+# トークン種別ごとにクレームの形は固定のため、JSONのひな形を事前に用意する
+# （sub, iat, exp の順に埋め込む。jti はBase64URL文字のみでエスケープ不要）
+_ACCESS_CLAIMS_TEMPLATE = '{"sub":%s,"iat":%d,"exp":%d,"type":"access"}'
+_REFRESH_CLAIMS_TEMPLATE = (
+    '{"sub":%s,"iat":%d,"exp":%d,"type":"refresh","jti":"%s"}'
+)
+
+# bcrypt専用スレッドプール（CPU負荷の高いKDFでイベントループを止めないため）
+# デフォルトのexecutorと分けることで、ログイン集中時に他のI/O処理を巻き込まない
+# bcrypt.checkpw / hashpw はハッシュ計算中にGILを解放するため、CPUコア数まで並列に動作する
+# 複数件をまとめて検証する場合も、ループで逐次 await せず
+# asyncio.gather で _verify_password を同時に投入すること
+_BCRYPT_POOL = ThreadPoolExecutor(
+    max_workers=os.cpu_count(),
+    thread_name_prefix="bcrypt"
+)
+
+
+class _RandomBytePool:
+    """os.urandom の出力をまとめて取得し、必要な長さずつ切り出す乱数プール"""
+    
+    def __init__(self, refill_size: int = 4096):
+        self._refill_size = refill_size
+        self._reset()
+        # fork後の子プロセスが親と同じ乱数列を使わないよう破棄する
+        os.register_at_fork(after_in_child=self._reset)
+    
+    def _reset(self) -> None:
+        self._buffer = bytearray()
+        self._lock = threading.Lock()
+    
+    def take(self, size: int) -> bytes:
+        """暗号論的に安全な乱数を size バイト取り出す"""
+        with self._lock:
+            if len(self._buffer) < size:
+                self._buffer = bytearray(os.urandom(max(self._refill_size, size)))
+            chunk = bytes(self._buffer[:size])
+            # 一度切り出した乱数は再利用しない
+            del self._buffer[:size]
+            return chunk
+
+
+# トークンID用の乱数プール（リフレッシュトークン発行毎のシステムコールを避ける）
+_RANDOM_POOL = _RandomBytePool()
+
+
+def _b64url_encode(data: bytes) -> bytes:
+    """JWT用のBase64URLエンコード（パディングなし）"""
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+def _b64url_decode(data: bytes) -> bytes:
+    """JWT用のBase64URLデコード（不正な文字はエラー）"""
+    return base64.b64decode(
+        data + b"=" * (-len(data) % 4), altchars=b"-_", validate=True
+    )
+
+
+def _encode_password_hash(hashed_password: Union[str, bytes]) -> bytes:
+    """保存済みハッシュをbcrypt用のbytesに変換（bytesで保存されていればそのまま使う）"""
+    if isinstance(hashed_password, bytes):
+        return hashed_password
+    return hashed_password.encode('ascii')
+
+
+def _validate_email_format(email: str) -> bool:
+    """メールアドレス形式の簡易検証"""
+    return _EMAIL_PATTERN.fullmatch(email) is not None
+
+
+class _TraceIdGenerator:
+    """プロセス毎のランダムなプレフィックスと連番によるトレースID生成"""
+    
+    def __init__(self):
+        self._reset()
+        # fork後の子プロセスが親と同じIDを発行しないよう作り直す
+        os.register_at_fork(after_in_child=self._reset)
+    
+    def _reset(self) -> None:
+        # プロセス毎にランダムなプレフィックスを持たせ、再起動やワーカー間でも一意にする
+        self._prefix = secrets.token_hex(8)
+        self._counter = itertools.count()
+    
+    def generate(self) -> str:
+        """トレースIDの生成（uuid4と異なりシステムコールを伴わない）"""
+        return f"{self._prefix}{next(self._counter):016x}"
+
+
+# リクエストにトレースIDがない場合の採番用
+_TRACE_ID_GENERATOR = _TraceIdGenerator()
+
 
 class AuthService:
     """認証サービスクラス"""
@@ -39,6 +155,36 @@ class AuthService:
         self.jwt_algorithm = "HS256"
         self.access_token_expire_minutes = 60
         self.refresh_token_expire_days = 7
+        # トークン発行毎に換算しないよう、有効期間を秒に変換しておく
+        self._access_token_expire_seconds = int(
+            timedelta(minutes=self.access_token_expire_minutes).total_seconds()
+        )
+        self._refresh_token_expire_seconds = int(
+            timedelta(days=self.refresh_token_expire_days).total_seconds()
+        )
+        # JWTヘッダーは固定のため、エンコード済みの値を使い回す
+        # 検証時はこのバイト列と完全一致を要求するため、キー順とセパレータを固定する
+        # （PyJWTと同じ {"alg":"HS256","typ":"JWT"} になる）
+        self._signing_key = self.jwt_secret.encode('utf-8')
+        self._header_b64 = _b64url_encode(
+            json.dumps(
+                {"alg": self.jwt_algorithm, "typ": "JWT"},
+                separators=(",", ":"),
+                sort_keys=True
+            ).encode('utf-8')
+        )
+        # bcryptのコスト（変更時は次回ログイン成功時に再ハッシュされる）
+        self.bcrypt_rounds = getattr(settings, "BCRYPT_ROUNDS", DEFAULT_BCRYPT_ROUNDS)
+        # bcrypt検証成功のキャッシュ（キー -> 有効期限）
+        # キーはプロセス内乱数によるHMAC値のみで、平文・ハッシュは保持しない
+        self._verify_cache_key = secrets.token_bytes(32)
+        self._verify_cache: OrderedDict[bytes, float] = OrderedDict()
+        # ユーザー不在時にも同じコストのbcrypt検証を行うためのダミーハッシュ
+        # （応答時間から登録済みメールアドレスかどうかを推測されないようにする）
+        # インポート時にbcryptを実行しないよう、初回使用時に生成する
+        self._dummy_password_hash: Optional[bytes] = None
+        # bcrypt検証にかかる平均時間（秒）。形式不正時の待機時間に使用
+        self._average_verify_seconds = 0.25
     
     async def authenticate_user(
         self,
@@ -60,27 +206,44 @@ class AuthService:
         Raises:
             AuthenticationError: 認証失敗時
         """
+        # 明らかに不正な形式はDB・bcryptに到達させない
+        # 応答時間は通常の検証に合わせるが、CPUを使わない待機で済ませる
+        # （形式の正否は攻撃者にも自明なため、bcryptで隠す意味はない）
+        if not _validate_email_format(email):
+            await asyncio.sleep(self._average_verify_seconds)
+            raise AuthenticationError(
+                "IDまたはパスワードが正しくありません",
+                error_code="AUTH_001",
+                trace_id=trace_id
+            )
+        
         try:
             # ユーザーの取得
             user = await self._get_user_by_email(email, trace_id)
             
             # パスワード検証（bcryptを使用）
-            if not self._verify_password(password, user.password_hash):
+            if not await self._verify_password(password, user.password_hash):
                 # セキュリティ規約: IDとパスワードどちらが違うか明示しない
-                logger.warning(
-                    "Authentication failed",
-                    extra={
-                        "trace_id": trace_id,
-                        "user_id": user.id if user else None,
-                        "error_type": "invalid_credentials"
-                    }
-                )
+                # 総当たり攻撃時はこの経路のみが実行されるため、
+                # 出力されない場合は extra の組み立て自体を省略する
+                if logger.isEnabledFor(logging.WARNING):
+                    logger.warning(
+                        "Authentication failed",
+                        extra={
+                            "trace_id": trace_id,
+                            "user_id": user.id,
+                            "error_type": "invalid_credentials"
+                        }
+                    )
                 raise AuthenticationError(
                     "IDまたはパスワードが正しくありません",
                     error_code="AUTH_001",
                     trace_id=trace_id
                 )
             
+            # コスト設定が変わっていれば、平文が手元にある今のうちに再ハッシュ
+            await self._migrate_password_hash(user, password, trace_id)
+            
             # アクセストークンとリフレッシュトークンの生成
             access_token = self._create_access_token(user.id)
             refresh_token = self._create_refresh_token(user.id)
@@ -108,17 +271,22 @@ class AuthService:
                 "error": None,
                 "meta": {
                     "trace_id": trace_id,
-                    "timestamp": datetime.utcnow().isoformat() + "Z"
+                    # API設計規約のタイムスタンプ形式（秒精度のUTC）
+                    "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
                 }
             }
             
         except UserNotFoundException:
-            # ユーザーが見つからない場合も同じエラーメッセージ
+            # ユーザーが見つからない場合も同じエラーメッセージ・同じ検証コスト
+            await self._run_dummy_verification(password)
             raise AuthenticationError(
                 "IDまたはパスワードが正しくありません",
                 error_code="AUTH_001",
                 trace_id=trace_id
             )
+        except AuthenticationError:
+            # 認証失敗は想定内のため、下のERRORログ（スタックトレース付き）を出さずにそのまま送出
+            raise
         except Exception as e:
             logger.error(
                 "Unexpected error during authentication",
@@ -145,37 +313,141 @@ class AuthService:
             )
         return user
     
-    def _verify_password(
+    async def _verify_password(
         self,
         plain_password: str,
-        hashed_password: str
+        hashed_password: Union[str, bytes]
     ) -> bool:
-        """パスワードの検証（bcrypt使用）"""
-        return bcrypt.checkpw(
+        """パスワードの検証（bcrypt使用、成功結果は短時間キャッシュ）"""
+        plain_bytes = plain_password.encode('utf-8')
+        hashed_bytes = _encode_password_hash(hashed_password)
+        cache_key = hmac.new(
+            self._verify_cache_key,
+            hashed_bytes + b"|" + plain_bytes,
+            hashlib.sha256
+        ).digest()
+        
+        now = time.monotonic()
+        expires_at = self._verify_cache.get(cache_key)
+        if expires_at is not None and expires_at > now:
+            self._verify_cache.move_to_end(cache_key)
+            return True
+        
+        is_valid = await self._run_bcrypt_check(plain_bytes, hashed_bytes)
+        
+        # 失敗結果はキャッシュしない（総当たり攻撃で正規ユーザーのエントリが追い出されるため）
+        if is_valid:
+            self._verify_cache[cache_key] = now + VERIFY_CACHE_TTL_SECONDS
+            self._verify_cache.move_to_end(cache_key)
+            if len(self._verify_cache) > VERIFY_CACHE_MAX_ENTRIES:
+                self._verify_cache.popitem(last=False)
+        return is_valid
+    
+    async def _run_bcrypt_check(
+        self,
+        plain_bytes: bytes,
+        hashed_bytes: bytes
+    ) -> bool:
+        """bcrypt専用プールで検証し、所要時間の平均を更新する"""
+        started_at = time.perf_counter()
+        is_valid = await asyncio.get_running_loop().run_in_executor(
+            _BCRYPT_POOL, bcrypt.checkpw, plain_bytes, hashed_bytes
+        )
+        # 指数移動平均で検証時間を追従させる
+        self._average_verify_seconds += (
+            time.perf_counter() - started_at - self._average_verify_seconds
+        ) * 0.1
+        return is_valid
+    
+    async def _run_dummy_verification(self, plain_password: str) -> None:
+        """ダミーハッシュに対してbcrypt検証を行い、実際の検証と処理時間を揃える"""
+        if self._dummy_password_hash is None:
+            self._dummy_password_hash = (
+                await self._hash_password(secrets.token_urlsafe(16))
+            ).encode('ascii')
+        await self._run_bcrypt_check(
+            plain_password.encode('utf-8'), self._dummy_password_hash
+        )
+    
+    async def _migrate_password_hash(
+        self,
+        user: User,
+        plain_password: str,
+        trace_id: str
+    ) -> None:
+        """必要に応じて現在のコストで再ハッシュし保存する（失敗してもログインは継続）"""
+        try:
+            if self._needs_rehash(user.password_hash):
+                new_hash = await self._hash_password(plain_password)
+                await user.update_password_hash(new_hash)
+        except Exception as e:
+            # フォールバック: 移行は次回ログイン時に再試行されるため、認証結果には影響させない
+            logger.warning(
+                "Password hash migration failed",
+                extra={
+                    "trace_id": trace_id,
+                    "user_id": user.id,
+                    "error_type": "password_rehash_failed",
+                    "error": str(e)
+                }
+            )
+    
+    def _needs_rehash(self, hashed_password: Union[str, bytes]) -> bool:
+        """ハッシュのコストが現在の設定と異なるか判定"""
+        # bcryptハッシュ形式: $2b$<コスト>$<salt+hash>
+        cost = _encode_password_hash(hashed_password).split(b"$")[2]
+        return int(cost) != self.bcrypt_rounds
+    
+    async def _hash_password(self, plain_password: str) -> str:
+        """パスワードのハッシュ化（bcrypt使用、保存形式に合わせて文字列で返す）"""
+        hashed = await asyncio.get_running_loop().run_in_executor(
+            _BCRYPT_POOL,
+            bcrypt.hashpw,
             plain_password.encode('utf-8'),
-            hashed_password.encode('utf-8')
+            bcrypt.gensalt(rounds=self.bcrypt_rounds)
         )
+        return hashed.decode('ascii')
     
     def _create_access_token(self, user_id: str) -> str:
         """アクセストークンの生成"""
-        payload = {
-            "sub": user_id,
-            "exp": datetime.utcnow() + timedelta(minutes=self.access_token_expire_minutes),
-            "iat": datetime.utcnow(),
-            "type": "access"
-        }
-        return jwt.encode(payload, self.jwt_secret, algorithm=self.jwt_algorithm)
+        return self._create_token(
+            _ACCESS_CLAIMS_TEMPLATE,
+            user_id,
+            self._access_token_expire_seconds
+        )
     
     def _create_refresh_token(self, user_id: str) -> str:
         """リフレッシュトークンの生成"""
-        payload = {
-            "sub": user_id,
-            "exp": datetime.utcnow() + timedelta(days=self.refresh_token_expire_days),
-            "iat": datetime.utcnow(),
-            "type": "refresh",
-            "jti": secrets.token_urlsafe(32)  # ユニークなトークンID
-        }
-        return jwt.encode(payload, self.jwt_secret, algorithm=self.jwt_algorithm)
+        return self._create_token(
+            _REFRESH_CLAIMS_TEMPLATE,
+            user_id,
+            self._refresh_token_expire_seconds,
+            # ユニークなトークンID
+            _b64url_encode(_RANDOM_POOL.take(32)).decode('ascii')
+        )
+    
+    def _create_token(
+        self,
+        claims_template: str,
+        user_id: str,
+        expire_seconds: int,
+        *extra_values: str
+    ) -> str:
+        """トークンの生成（発行時刻は1回だけ取得し、UNIX秒で格納）"""
+        now = int(time.time())
+        # 可変なのは sub のみのため、JSONエスケープはこの値に限定する
+        claims = claims_template % (
+            json.dumps(str(user_id)), now, now + expire_seconds, *extra_values
+        )
+        return self._encode_token(claims.encode('utf-8'))
+    
+    def _encode_token(self, claims: bytes) -> str:
+        """JWT（HS256）のエンコードと署名"""
+        signing_input = self._header_b64 + b"." + _b64url_encode(claims)
+        signature = hmac.new(
+            self._signing_key, signing_input, hashlib.sha256
+        ).digest()
+        return (signing_input + b"." + _b64url_encode(signature)).decode('ascii')
     
     async def verify_token(
         self,
@@ -183,71 +455,195 @@ class AuthService:
         trace_id: str
     ) -> str:
         """トークンの検証"""
-        try:
-            payload = jwt.decode(
-                credentials.credentials,
-                self.jwt_secret,
-                algorithms=[self.jwt_algorithm]
+        payload = self._decode_token(credentials.credentials, trace_id)
+        
+        # トークンタイプの確認
+        if payload.get("type") != "access":
+            raise AuthorizationError(
+                "Invalid token type",
+                error_code="AUTH_002",
+                trace_id=trace_id
             )
+        
+        return payload["sub"]  # user_id
+    
+    def _decode_token(self, token: str, trace_id: str) -> dict:
+        """JWT（HS256）の署名と有効期限を検証してペイロードを返す"""
+        try:
+            signing_input, _, signature_b64 = token.encode('ascii').rpartition(b".")
+            header_b64, _, payload_b64 = signing_input.partition(b".")
             
-            # トークンタイプの確認
-            if payload.get("type") != "access":
-                raise AuthorizationError(
-                    "Invalid token type",
-                    error_code="AUTH_002",
-                    trace_id=trace_id
-                )
+            # 自身が発行する固定ヘッダー以外（alg=none 等）は受け付けない
+            if header_b64 != self._header_b64:
+                raise ValueError("Unexpected token header")
             
-            return payload["sub"]  # user_id
+            expected_signature = hmac.new(
+                self._signing_key, signing_input, hashlib.sha256
+            ).digest()
+            if not hmac.compare_digest(
+                expected_signature, _b64url_decode(signature_b64)
+            ):
+                raise ValueError("Signature mismatch")
             
-        except jwt.ExpiredSignatureError:
+            payload = json.loads(_b64url_decode(payload_b64))
+            if (
+                not isinstance(payload, dict)
+                or not isinstance(payload.get("exp"), int)
+                or not isinstance(payload.get("iat"), int)
+            ):
+                raise ValueError("Malformed token claims")
+        except ValueError as e:
+            raise AuthorizationError(
+                "Invalid token",
+                error_code="AUTH_004",
+                trace_id=trace_id
+            ) from e
+        
+        now = time.time()
+        if payload["exp"] <= now:
             raise AuthorizationError(
                 "Token has expired",
                 error_code="AUTH_003",
                 trace_id=trace_id
             )
-        except jwt.JWTError:
+        
+        # 未来の発行時刻は自身が発行したトークンとして不正
+        if payload["iat"] > now:
             raise AuthorizationError(
                 "Invalid token",
                 error_code="AUTH_004",
                 trace_id=trace_id
             )
+        
+        return payload
 
 
 # Rate limiting decorator（企業規約: すべてのAPIにrate limiting実装）
 from functools import wraps
-from collections import defaultdict
-from datetime import datetime
-import asyncio
+
+# Redisは複数ワーカー構成でのみ必要なため任意依存とする
+try:
+    from redis.asyncio import Redis
+    from redis.exceptions import RedisError
+except ImportError:
+    Redis = None
+    
+    class RedisError(Exception):
+        """redis未導入時のプレースホルダ（送出されることはない）"""
 
 class RateLimiter:
-    """レート制限の実装"""
+    """
+    レート制限の実装
+    
+    Redisクライアントが渡された場合は全ワーカー共通のカウンタで制限し、
+    それ以外（またはRedis障害時）はプロセス内のトークンバケットで制限する。
+    """
+    
+    # 全リクエストで参照されるため属性アクセスを固定スロット化
+    __slots__ = (
+        "max_attempts", "window", "max_keys", "redis", "_redis_available",
+        "attempts", "_refill_rate", "_cleanup_task"
+    )
     
-    def __init__(self, max_attempts: int = 5, window: int = 300):
+    def __init__(
+        self,
+        max_attempts: int = 5,
+        window: int = 300,
+        max_keys: int = 100_000,
+        redis: Optional["Redis"] = None
+    ):
         self.max_attempts = max_attempts
         self.window = window  # 秒
-        self.attempts = defaultdict(list)
+        self.max_keys = max_keys
+        self.redis = redis
+        # 障害ログを状態が変わった時だけ出すためのフラグ
+        self._redis_available = True
+        # 1秒あたりの補充トークン数（チェック毎の除算を避けるため事前計算）
+        self._refill_rate = max_attempts / window
+        # key -> [残りトークン数, 最終補充時刻]。LRU順で保持し件数を上限で抑える
+        self.attempts: OrderedDict[str, list[float]] = OrderedDict()
         self._cleanup_task = None
     
     async def check_rate_limit(self, key: str) -> bool:
         """レート制限のチェック"""
-        now = datetime.utcnow()
+        if self.redis is not None:
+            try:
+                is_allowed = await self._check_shared_rate_limit(key)
+            except RedisError as e:
+                # フォールバック: Redis障害時もレート制限自体は継続する
+                # 攻撃中の障害でログが溢れないよう、障害発生時に1回だけ出力する
+                if self._redis_available:
+                    self._redis_available = False
+                    logger.warning(
+                        "Rate limit store unavailable, using local limiter",
+                        extra={
+                            "error_type": "rate_limit_store_unavailable",
+                            "error": str(e)
+                        }
+                    )
+            else:
+                if not self._redis_available:
+                    self._redis_available = True
+                    logger.info("Rate limit store recovered")
+                return is_allowed
+        return await self._check_local_rate_limit(key)
+    
+    async def _check_shared_rate_limit(self, key: str) -> bool:
+        """Redisの固定ウィンドウカウンタによるチェック（1往復）"""
+        redis_key = f"rl:{key}"
+        pipe = self.redis.pipeline()
+        # 有効期限はウィンドウの最初の試行でのみ設定する
+        # （INCRの度にEXPIREすると試行が続く限りカウンタが消えないため）
+        pipe.set(redis_key, 0, ex=self.window, nx=True)
+        pipe.incr(redis_key)
+        _, count = await pipe.execute()
+        return count <= self.max_attempts
+    
+    async def _check_local_rate_limit(self, key: str) -> bool:
+        """プロセス内のトークンバケットによるチェック"""
+        # クリーンアップはイベントループ上でのみ開始できるため呼び出し時に起動
+        # （起動したループが終了してタスクが止まっていれば、現在のループで再起動する）
+        if self._cleanup_task is None or self._cleanup_task.done():
+            self._cleanup_task = asyncio.create_task(self._sweep_expired_keys())
         
-        # 古いエントリをクリーンアップ
-        cutoff = now - timedelta(seconds=self.window)
-        self.attempts[key] = [
-            attempt for attempt in self.attempts[key]
-            if attempt > cutoff
-        ]
+        # 壁時計ではなく単調時計を使用（時刻補正の影響を受けない）
+        now = time.monotonic()
+        bucket = self.attempts.get(key)
+        if bucket is None:
+            bucket = self.attempts[key] = [self.max_attempts, now]
+            # 上限を超えた場合は最も古いキーを破棄（件数が増えるのは新規キーのみ）
+            if len(self.attempts) > self.max_keys:
+                self.attempts.popitem(last=False)
+        
+        # 経過時間に応じてトークンを補充（上限は max_attempts）
+        tokens = min(
+            self.max_attempts,
+            bucket[0] + (now - bucket[1]) * self._refill_rate
+        )
         
         # 制限チェック
-        if len(self.attempts[key]) >= self.max_attempts:
+        if tokens < 1:
             return False
         
-        # 新しい試行を記録
-        self.attempts[key].append(now)
+        # 試行を1回分消費（リクエスト毎にタプルを生成しないよう同じバケットを更新）
+        bucket[0] = tokens - 1
+        bucket[1] = now
+        self.attempts.move_to_end(key)
         return True
     
+    async def _sweep_expired_keys(self) -> None:
+        """ウィンドウ期間アクセスのないキーを定期的に削除"""
+        while True:
+            await asyncio.sleep(self.window)
+            cutoff = time.monotonic() - self.window
+            # 先頭ほど最終補充時刻が古いため、期限内のキーに達した時点で終了
+            # （ウィンドウ経過後はトークンが満タンに戻るため、削除しても挙動は変わらない）
+            while self.attempts:
+                key, (_, last_refill) = next(iter(self.attempts.items()))
+                if last_refill >= cutoff:
+                    break
+                del self.attempts[key]
+    
     def __call__(self, func):
         """デコレータとして使用"""
         @wraps(func)
@@ -265,8 +661,45 @@ class RateLimiter:
         return wrapper
 
 
+def _create_rate_limit_redis() -> Optional["Redis"]:
+    """設定されていればレート制限用のRedisクライアントを生成"""
+    redis_url = getattr(settings, "RATE_LIMIT_REDIS_URL", None)
+    if not redis_url:
+        return None
+    if Redis is None:
+        raise RuntimeError("RATE_LIMIT_REDIS_URL requires the redis package")
+    timeout_seconds = getattr(
+        settings,
+        "RATE_LIMIT_REDIS_TIMEOUT_SECONDS",
+        DEFAULT_RATE_LIMIT_REDIS_TIMEOUT_SECONDS
+    )
+    # タイムアウト未指定（redis-pyの既定値はNone）だと、応答のないRedisで
+    # check_rate_limit が無期限に待ち、フォールバックも働かない
+    return Redis.from_url(
+        redis_url,
+        socket_timeout=timeout_seconds,
+        socket_connect_timeout=timeout_seconds
+    )
+
+
 # 使用例
-rate_limiter = RateLimiter(max_attempts=5, window=300)
+# 複数ワーカーで動かす場合は RATE_LIMIT_REDIS_URL を必ず設定する
+# （未設定だとワーカー毎に独立して制限され、実質ワーカー数倍の試行を許してしまう）
+rate_limiter = RateLimiter(
+    max_attempts=5,
+    window=300,
+    redis=_create_rate_limit_redis()
+)
+
+# AuthServiceはリクエスト固有の状態を持たないため、プロセス内で1つを共有する
+# （リクエスト毎に生成すると検証キャッシュやJWTヘッダーの事前計算が無駄になる）
+auth_service = AuthService()
+
+
+def get_auth_service() -> AuthService:
+    """FastAPIの依存性注入用（例: Depends(get_auth_service)）"""
+    return auth_service
+
 
 @rate_limiter
 async def login_endpoint(
@@ -277,7 +710,6 @@ async def login_endpoint(
 ):
     """ログインエンドポイント（rate limiting適用）"""
     if not trace_id:
-        trace_id = str(uuid.uuid4())
+        trace_id = _TRACE_ID_GENERATOR.generate()
     
-    auth_service = AuthService()
     return await auth_service.authenticate_user(email, password, trace_id)